@@ -20,4 +20,5 @@ this documentation is on the differences and additions to the Web API.
 
 import os
 
-from meetling.meetling import Meetling, Meeting, AgendaItem
+from meetling.meetling import (Meetling, User, AuthCache, EditCoalescer, ConflictError, Versioned,
+                              Meeting, AgendaItem)
@@ -14,20 +14,78 @@
 
 """Meetling script."""
 
+from argparse import ArgumentParser
+import signal
 import sys
 
 from micro.util import make_command_line_parser, setup_logging
+from tornado.ioloop import IOLoop
 
+from meetling import Meetling
+from meetling.backup import export_data, import_data
 from meetling.server import make_server
+from meetling.storage import MemoryRedis
 
 def main(args):
     """Run Meetling.
 
     *args* is the list of command line arguments. See ``python3 -m meetling -h``.
+
+    With the command ``export`` or ``import``, the database is exported to or imported from a file
+    instead (see :mod:`meetling.backup`). See ``python3 -m meetling export -h``.
     """
-    args = make_command_line_parser().parse_args(args[1:])
+    if len(args) > 1 and args[1] in ['export', 'import']:
+        return _transfer(args)
+
+    parser = make_command_line_parser()
+    parser.add_argument(
+        '--shard-url', action='append', dest='shard_urls',
+        help='URL of a Redis database to distribute meetings across. May be given multiple times.')
+    parser.add_argument(
+        '--profile', type=float, metavar='FRACTION',
+        help='Fraction of requests to profile. Staff members can change it at runtime and get the '
+             'stacks in folded format at /api/profiler/stacks.')
+    args = parser.parse_args(args[1:])
     setup_logging(args.debug if 'debug' in args else False)
-    make_server(**vars(args)).run()
+    server = make_server(**vars(args))
+    # Exit functions do not run if the process is killed by a signal, so on SIGTERM, e.g. sent by a
+    # service manager, stop the server and exit normally
+    signal.signal(signal.SIGTERM, _stop)
+    server.run()
+    return 0
+
+def _stop(signum, frame):
+    # pylint: disable=unused-argument; signal handler
+    loop = IOLoop.current()
+    loop.add_callback_from_signal(loop.stop)
+
+def _transfer(args):
+    command = args[1]
+    parser = ArgumentParser(prog='python3 -m meetling ' + command,
+                            description='{} the whole database.'.format(command.capitalize()))
+    parser.add_argument('--redis-url', default='', help='URL of the Redis database.')
+    parser.add_argument(
+        '--shard-url', action='append', dest='shard_urls', default=[],
+        help='URL of a Redis database meetings are distributed across. May be given multiple '
+             'times.')
+    parser.add_argument('file', nargs='?', default='-',
+                        help='NDJSON file. Defaults to standard output or input.')
+    args = parser.parse_args(args[2:])
+    setup_logging(False)
+
+    app = Meetling(redis_url=args.redis_url, shard_urls=args.shard_urls)
+    if command == 'export':
+        with open(args.file, 'w') if args.file != '-' else sys.stdout as f:
+            stats = export_data(app, f)
+    else:
+        with open(args.file) if args.file != '-' else sys.stdin as f:
+            stats = import_data(app, f)
+        app.update()
+        # Snapshots are otherwise only written by the server
+        for node in [app.r.r.primary] + list(app.r.r.shards.values()):
+            if isinstance(node, MemoryRedis) and node.path:
+                node.save()
+    print('{}ed {}'.format(command.capitalize(), stats), file=sys.stderr)
     return 0
 
 if __name__ == '__main__':
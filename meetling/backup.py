@@ -0,0 +1,226 @@
+# Meetling
+# Copyright (C) 2017 Meetling contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""Export and import of the whole database.
+
+The data is streamed as NDJSON, i.e. one JSON object per line. For every meeting, the meeting is
+written, followed by its agenda items and then its trashed agenda items, in order, all as stored in
+the database. Any other data, like users and settings, is written as key records
+``{"__type__": "Key", "key", "type", "value"}``, where *type* is the Redis type of the key.
+"""
+
+from collections import OrderedDict
+import json
+from logging import getLogger
+from time import perf_counter
+
+from micro import ValueError
+
+BATCH_SIZE = 1000
+"""Number of meetings read or commands written at once."""
+
+_logger = getLogger(__name__)
+
+class TransferStats:
+    """Statistics of an export or import.
+
+    .. attribute:: objects
+
+       Number of transferred records.
+
+    .. attribute:: size
+
+       Size of the transferred data in bytes.
+
+    .. attribute:: duration
+
+       Duration of the transfer in seconds.
+    """
+
+    def __init__(self):
+        self.objects = 0
+        self.size = 0
+        self.duration = 0
+        self._start = perf_counter()
+
+    def add(self, line):
+        """Count the transferred record *line*."""
+        self.objects += 1
+        self.size += len(line)
+        self.duration = perf_counter() - self._start
+        if self.objects % (BATCH_SIZE * 10) == 0:
+            _logger.info('%s', self)
+
+    def __str__(self):
+        rate = self.objects / self.duration if self.duration else 0
+        return '{} objects ({:.1f} MiB) in {:.1f} s ({:.0f} objects/s)'.format(
+            self.objects, self.size / (1024 * 1024), self.duration, rate)
+
+def export_data(app, f):
+    """Write all data of *app* to the text file *f*.
+
+    Meetings are read in batches of :data:`BATCH_SIZE`, with two round trips per batch and node, and
+    only a single batch is held in memory at once. Keys deleted during the export are skipped.
+    Return the :class:`TransferStats`.
+    """
+    r = app.r.r
+    stats = TransferStats()
+
+    def _write(line):
+        f.write(line + '\n')
+        stats.add(line)
+
+    for key in r.primary.scan_iter():
+        key = key.decode()
+        if not _is_meeting_key(key):
+            record = _dump_key(r.primary, key)
+            if record:
+                _write(json.dumps(record))
+
+    start = 0
+    while True:
+        meeting_ids = [id.decode() for id in
+                       r.primary.lrange('meetings', start, start + BATCH_SIZE - 1)]
+        if not meeting_ids:
+            break
+        start += len(meeting_ids)
+
+        groups = OrderedDict()
+        for meeting_id in meeting_ids:
+            groups.setdefault(r.node_for_tag(meeting_id), []).append(meeting_id)
+        meetings = {}
+        for node, ids in groups.items():
+            meetings.update(_read_meetings(node, ids))
+
+        for meeting_id in meeting_ids:
+            meeting, items = meetings[meeting_id]
+            if meeting is None:
+                _logger.warning('Skipped missing %s', meeting_id)
+                continue
+            _write(meeting.decode())
+            for item in items:
+                if item is not None:
+                    _write(item.decode())
+    return stats
+
+def import_data(app, f):
+    """Read all data from the text file *f*, written by :func:`export_data`, into *app*.
+
+    The database must be empty, otherwise a :exc:`ValueError` (``database_not_empty``) is raised. If
+    *f* contains an unknown record, a :exc:`ValueError` (``record_invalid``) is raised. Writes are
+    pipelined in batches. Return the :class:`TransferStats`.
+    """
+    r = app.r.r
+    if r.primary.exists('version'):
+        raise ValueError('database_not_empty')
+    stats = TransferStats()
+    pipelines = {}
+    meeting_id = None
+
+    def _pipeline(node):
+        if node not in pipelines:
+            pipelines[node] = node.pipeline(transaction=False)
+        return pipelines[node]
+
+    def _flush():
+        for p in pipelines.values():
+            p.execute()
+        pipelines.clear()
+
+    for i, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        type = record.get('__type__')
+
+        if type == 'Key':
+            _load_key(_pipeline(r.primary), record)
+        elif type == 'Meeting':
+            meeting_id = record['id']
+            _pipeline(r.node_for_tag(meeting_id)).set(meeting_id, line)
+            _pipeline(r.primary).rpush('meetings', meeting_id)
+        elif type == 'AgendaItem' and meeting_id:
+            p = _pipeline(r.node_for_tag(meeting_id))
+            p.set(record['id'], line)
+            p.rpush(meeting_id + ('.trashed_items' if record['trashed'] else '.items'),
+                    record['id'])
+            _pipeline(r.primary).hset('agenda_item_meetings', record['id'], meeting_id)
+        else:
+            raise ValueError('record_invalid')
+        stats.add(line)
+
+        if i % BATCH_SIZE == 0:
+            _flush()
+    _flush()
+    return stats
+
+def _read_meetings(node, ids):
+    # Read the meetings with ids and their items from node, in two round trips
+    p = node.pipeline(transaction=False)
+    for id in ids:
+        p.get(id)
+        p.lrange(id + '.items', 0, -1)
+        p.lrange(id + '.trashed_items', 0, -1)
+    results = p.execute()
+
+    item_ids = {}
+    for i, id in enumerate(ids):
+        item_ids[id] = results[i * 3 + 1] + results[i * 3 + 2]
+    all_item_ids = [item_id for id in ids for item_id in item_ids[id]]
+    items = iter(node.mget(all_item_ids) if all_item_ids else [])
+    return {id: (results[i * 3], [next(items) for _ in item_ids[id]])
+            for i, id in enumerate(ids)}
+
+def _is_meeting_key(key):
+    return (key.startswith(('Meeting:', 'AgendaItem:')) or
+            key in ('meetings', 'agenda_item_meetings'))
+
+def _dump_key(r, key):
+    # The database is live, so the key may be deleted at any point. Redis has no empty containers,
+    # so an empty value means the key is gone.
+    type = r.type(key).decode()
+    if type == 'none':
+        return None
+    if type == 'string':
+        value = r.get(key)
+        value = value.decode() if value is not None else None
+    elif type == 'list':
+        value = [v.decode() for v in r.lrange(key, 0, -1)] or None
+    elif type == 'hash':
+        value = {k.decode(): v.decode() for k, v in r.hgetall(key).items()} or None
+    elif type == 'set':
+        value = sorted(v.decode() for v in r.smembers(key)) or None
+    else:
+        _logger.warning('Skipped %s of unsupported type %s', key, type)
+        return None
+    if value is None:
+        return None
+    return {'__type__': 'Key', 'key': key, 'type': type, 'value': value}
+
+def _load_key(p, record):
+    key, value = record['key'], record['value']
+    if record['type'] == 'string':
+        p.set(key, value)
+    elif record['type'] == 'list':
+        if value:
+            p.rpush(key, *value)
+    elif record['type'] == 'hash':
+        if value:
+            p.hmset(key, value)
+    elif record['type'] == 'set':
+        if value:
+            p.sadd(key, *value)
+    else:
+        raise ValueError('record_invalid')
@@ -15,37 +15,126 @@
 """Core parts of Meetling."""
 
 from datetime import datetime, timedelta
+from logging import getLogger
+from time import monotonic
 
+import micro
 from micro import (Application, Object, Editable, Settings, Event, ValueError, InputError,
                    PermissionError)
 from micro.jsonredis import JSONRedis, JSONRedisMapping
 from micro.util import parse_isotime, randstr, str_or_none
+from redis.exceptions import WatchError
+from tornado.ioloop import IOLoop
+
+from meetling.sharding import ShardedRedis
+from meetling.storage import MemoryRedis, connect
+
+_logger = getLogger(__name__)
 
 class Meetling(Application):
     """See :ref:`Meetling`.
 
+    *redis_url* may also refer to an embedded in-memory database (see :func:`connect`). Meetings are
+    distributed across the databases given by the list of URLs *shard_urls* (see
+    :class:`ShardedRedis`).
+
     .. attribute:: meetings
 
        Map of all :class:`Meeting` s.
+
+    .. attribute:: auth_cache
+
+       :class:`AuthCache` used by :meth:`authenticate`. Entries live for *auth_cache_ttl* seconds.
+
+    .. attribute:: edits
+
+       :class:`EditCoalescer` for edits of meetings and agenda items. Edits are coalesced within
+       *edit_window* seconds, ``0`` disables coalescing.
+
+    .. attribute:: transaction_attempts
+
+       Number of times a :meth:`transaction` is attempted before giving up.
     """
 
+    transaction_attempts = 5
+
     def __init__(self, redis_url='', email='bot@localhost', smtp_url='',
-                 render_email_auth_message=None):
-        super().__init__(redis_url=redis_url, email=email, smtp_url=smtp_url,
+                 render_email_auth_message=None, auth_cache_ttl=60, edit_window=0,
+                 shard_urls=[]):
+        storage = connect(redis_url)
+        super().__init__(redis_url='' if isinstance(storage, MemoryRedis) else redis_url,
+                         email=email, smtp_url=smtp_url,
                          render_email_auth_message=render_email_auth_message)
-        self.types.update({'Meeting': Meeting, 'AgendaItem': AgendaItem})
-        self.meetings = JSONRedisMapping(self.r, 'meetings')
+        self.r.r = ShardedRedis(storage, shard_urls)
+        self.types.update({'User': User, 'Meeting': Meeting, 'AgendaItem': AgendaItem})
+        self.meetings = _EditedMapping(self, 'meetings')
+        self.auth_cache = AuthCache(ttl=auth_cache_ttl)
+        self.edits = EditCoalescer(self, window=edit_window)
+
+    def authenticate(self, secret):
+        """See :meth:`Application.authenticate`.
+
+        Users are looked up in :attr:`auth_cache` first, so that repeated requests by the same user
+        do not hit the database.
+        """
+        user = self.auth_cache.get(secret)
+        if not user:
+            user = self._load_user(super().authenticate(secret))
+            self.auth_cache.set(secret, user)
+        self.user = user
+        return user
+
+    def login(self, *args, **kwargs):
+        """See :meth:`Application.login`.
+
+        The returned user is a :class:`User`.
+        """
+        self.user = self._load_user(super().login(*args, **kwargs))
+        return self.user
+
+    def transaction(self, func, *keys):
+        """Run *func* as optimistic transaction watching *keys*.
+
+        *func* is called with a Redis pipeline, on which it may read data and then, after calling
+        ``multi()``, queue writes. If any of *keys* is modified by someone else before the writes
+        are executed, *func* is called again, for at most :attr:`transaction_attempts` times. Then
+        a :exc:`ConflictError` is raised. The return value of *func* is returned.
+
+        All *keys* must be stored on the same node, i.e. belong to the same meeting.
+        """
+        for _ in range(self.transaction_attempts):
+            with self.r.r.node(keys[0]).pipeline() as p:
+                try:
+                    p.watch(*keys)
+                    result = func(p)
+                    p.execute()
+                    return result
+                except WatchError:
+                    continue
+        raise ConflictError()
+
+    def _load_user(self, user):
+        # Users created by micro itself, e.g. by Application.login(), are micro.User instances,
+        # which would bypass the invalidation of User.do_edit(), so load them as User instead
+        if user is None or isinstance(user, User):
+            return user
+        r = JSONRedis(self.r.r)
+        r.caching = False
+        args = r.oget(user.id)
+        del args['__type__']
+        return User(app=self, **args)
 
     def do_update(self):
         db_version = self.r.get('version')
 
         # If fresh, initialize database
         if not db_version:
-            self.r.set('version', 5)
+            self.r.set('version', 7)
             return
 
         db_version = int(db_version)
-        r = JSONRedis(self.r.r)
+        # Databases of previous versions are not sharded
+        r = JSONRedis(self.r.r.primary)
         r.caching = False
 
         # Deprecated since 0.12.0
@@ -56,6 +145,31 @@ class Meetling(Application):
             r.omset({u['id']: u for u in users})
             r.set('version', 5)
 
+        # Deprecated since 0.20.0
+        if db_version < 6:
+            meetings = r.omget(r.lrange('meetings', 0, -1))
+            for meeting in meetings:
+                meeting['version'] = 0
+                items = r.omget(r.lrange(meeting['id'] + '.items', 0, -1) +
+                                r.lrange(meeting['id'] + '.trashed_items', 0, -1))
+                for item in items:
+                    item['version'] = 0
+                if items:
+                    r.omset({i['id']: i for i in items})
+            if meetings:
+                r.omset({m['id']: m for m in meetings})
+            r.set('version', 6)
+
+        # Deprecated since 0.20.0
+        if db_version < 7:
+            for meeting_id in r.lrange('meetings', 0, -1):
+                meeting_id = meeting_id.decode()
+                item_ids = (r.lrange(meeting_id + '.items', 0, -1) +
+                            r.lrange(meeting_id + '.trashed_items', 0, -1))
+                if item_ids:
+                    r.hmset('agenda_item_meetings', {i: meeting_id for i in item_ids})
+            r.set('version', 7)
+
     def create_settings(self):
         return Settings(
             id='Settings', trashed=False, app=self, authors=[], title='My Meetling', icon=None,
@@ -75,7 +189,7 @@ class Meetling(Application):
         meeting = Meeting(
             id='Meeting:' + randstr(), trashed=False, app=self, authors=[self.user.id], title=title,
             time=time.isoformat() + 'Z' if time else None, location=str_or_none(location),
-            description=str_or_none(description))
+            description=str_or_none(description), version=0)
         self.r.oset(meeting.id, meeting)
         self.r.rpush('meetings', meeting.id)
 
@@ -98,7 +212,321 @@ class Meetling(Application):
                                    description='When and where will our next meeting be?')
         return meeting
 
-class Meeting(Object, Editable):
+class User(micro.User):
+    """See :class:`micro.User`.
+
+    Editing a user invalidates their :attr:`Meetling.auth_cache` entries.
+    """
+
+    def do_edit(self, **attrs):
+        super().do_edit(**attrs)
+        self.app.auth_cache.invalidate(user=self)
+
+class AuthCache:
+    """In-process cache mapping authentication secrets to :class:`User` s.
+
+    Entries expire after *ttl* seconds, which bounds how long changes made by other processes go
+    unnoticed. At most *max_size* entries are kept; if the cache is full, expired entries and then
+    the oldest entries are evicted. *clock* is a function returning the current time in seconds.
+
+    .. attribute:: ttl
+
+       Time in seconds an entry is valid.
+
+    .. attribute:: max_size
+
+       Maximum number of entries.
+
+    .. attribute:: hits
+
+       Number of lookups answered from the cache.
+
+    .. attribute:: misses
+
+       Number of lookups not answered from the cache.
+    """
+
+    def __init__(self, ttl=60, max_size=10000, clock=monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = {}
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups answered from the cache, between ``0`` and ``1``."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def get(self, secret):
+        """Return the cached user for *secret*.
+
+        If there is no valid entry, ``None`` is returned.
+        """
+        entry = self._entries.get(secret)
+        if entry and entry[1] > self._clock():
+            self.hits += 1
+            return entry[0]
+        if entry:
+            del self._entries[secret]
+        self.misses += 1
+        return None
+
+    def set(self, secret, user):
+        """Cache *user* for *secret*."""
+        now = self._clock()
+        self._entries.pop(secret, None)
+        if len(self._entries) >= self.max_size:
+            self._entries = {k: e for k, e in self._entries.items() if e[1] > now}
+            while len(self._entries) >= self.max_size:
+                del self._entries[next(iter(self._entries))]
+        self._entries[secret] = (user, now + self.ttl)
+
+    def invalidate(self, secret=None, user=None):
+        """Remove the entry for *secret* or all entries of *user*.
+
+        If neither is given, the cache is cleared.
+        """
+        if secret is None and user is None:
+            self._entries.clear()
+            return
+        if secret is not None:
+            self._entries.pop(secret, None)
+        if user is not None:
+            self._entries = {k: e for k, e in self._entries.items() if e[0].id != user.id}
+
+class EditCoalescer:
+    """Coalescer of rapid successive edits.
+
+    Edits of an object by the same user within *window* seconds after the first one are merged into
+    a single write and a single ``editable-edit`` event. Until then, the object with the pending
+    edits is returned by :attr:`Meetling.meetings`, :attr:`Meeting.items` and
+    :attr:`Meeting.trashed_items` of the same process. If the object is edited by another user or
+    written otherwise, the pending edits are stored immediately. If *window* is ``0``, edits are
+    not coalesced.
+
+    When an edit arrives, it is checked if the object has been written concurrently. If so, the edit
+    is not coalesced but stored immediately, so that a :exc:`ConflictError` is raised for the edit
+    itself. If an attribute with a pending edit is written concurrently, before the object is
+    checked again, the concurrent write wins: the pending edit of the attribute is discarded and the
+    conflict is logged, while the other pending edits are stored.
+
+    Pending edits are stored by the :class:`IOLoop` and should be stored with :meth:`flush` before
+    the process terminates.
+
+    .. attribute:: window
+
+       Time in seconds edits are coalesced.
+    """
+
+    def __init__(self, app, window=0):
+        self.app = app
+        self.window = window
+        self._pending = {}
+
+    def get(self, object):
+        """Return the instance of *object* with pending edits, or *object* if there is none."""
+        pending = self._pending.get(object.id)
+        return pending.object if pending else object
+
+    def edit(self, object, attrs):
+        """Edit *object* with *attrs* by the current user, see :meth:`Editable.edit`."""
+        base = object.json()
+        pending = self._pending.get(object.id)
+        if pending and (pending.object is not object or pending.user.id != self.app.user.id):
+            self.flush(object.id)
+            pending = None
+
+        version = pending.base['version'] if pending else base['version']
+        if self._stored_version(object) != version:
+            # The object has been written concurrently, so store the edit right away to report
+            # conflicts, after the already accepted edits
+            self.flush(object.id)
+            object.do_edit(**attrs)
+            object.commit(base, attrs.keys(), author=self.app.user)
+            self.app.activity.publish(Event.create('editable-edit', object, app=self.app))
+            return
+
+        object.do_edit(**attrs)
+        if not pending:
+            loop = IOLoop.current()
+            pending = _PendingEdit(object, self.app.user, base, loop,
+                                   loop.call_later(self.window, self.flush, object.id))
+            self._pending[object.id] = pending
+        pending.attrs.update(attrs)
+
+    def flush(self, id=None):
+        """Store the pending edits of the object with *id*.
+
+        If *id* is ``None``, all pending edits are stored. Attributes which have been written
+        concurrently keep the stored value. If storing fails, the error is logged and the object is
+        reloaded from the database.
+        """
+        ids = [id] if id else list(self._pending)
+        for object_id in ids:
+            pending = self._pending.pop(object_id, None)
+            if not pending:
+                continue
+            pending.loop.remove_timeout(pending.timeout)
+
+            user = self.app.user
+            self.app.user = pending.user
+            try:
+                conflicts = pending.object.commit(pending.base, pending.attrs, author=pending.user,
+                                                  keep_concurrent=True)
+                if conflicts:
+                    _logger.warning('Discarded edit of %s of %s by %s, written concurrently',
+                                    ', '.join(sorted(conflicts)), object_id, pending.user.id)
+                self.app.activity.publish(
+                    Event.create('editable-edit', pending.object, app=self.app))
+            except Exception: # pylint: disable=broad-except; flush is called by the IOLoop
+                _logger.exception('Failed to store edit of %s by %s', object_id, pending.user.id)
+                pending.object.reload()
+            finally:
+                self.app.user = user
+
+    def _stored_version(self, object):
+        r = JSONRedis(self.app.r.r)
+        r.caching = False
+        return r.oget(object.id)['version']
+
+class _PendingEdit:
+    def __init__(self, object, user, base, loop, timeout):
+        self.object = object
+        self.user = user
+        self.base = base
+        self.attrs = set()
+        self.loop = loop
+        self.timeout = timeout
+
+class _EditedMapping(JSONRedisMapping):
+    # JSONRedisMapping returning objects with pending edits (see EditCoalescer)
+
+    def __init__(self, app, map_key):
+        super().__init__(app.r, map_key)
+        self.app = app
+
+    def __getitem__(self, key):
+        return self.app.edits.get(super().__getitem__(key))
+
+    def values(self):
+        return [self.app.edits.get(o) for o in super().values()]
+
+class ConflictError(ValueError):
+    """See :ref:`ConflictError`.
+
+    .. attribute:: version
+
+       Current version of the object. May be ``None``.
+
+    .. attribute:: conflicts
+
+       List of attributes that were concurrently changed.
+    """
+
+    def __init__(self, version=None, conflicts=[]):
+        super().__init__('conflict')
+        self.version = version
+        self.conflicts = list(conflicts)
+
+class Versioned:
+    """Object with optimistic concurrency control.
+
+    Instead of overwriting the stored object, writes only change the modified attributes. If one of
+    them has been changed concurrently to a different value, the write fails with a
+    :exc:`ConflictError`.
+
+    .. attribute:: version
+
+       Number of times the object has been written.
+    """
+    # pylint: disable=no-member; mixin for Object
+
+    def __init__(self, version):
+        self.version = version
+
+    def edit(self, **attrs):
+        """See :meth:`Editable.edit`.
+
+        If an attribute of *attrs* has been edited concurrently, a :exc:`ConflictError` is raised.
+
+        Edits may be coalesced by :attr:`Meetling.edits`.
+        """
+        if not self.app.user:
+            raise PermissionError()
+        if self.app.edits.window:
+            self.app.edits.edit(self, attrs)
+            return
+        self.app.edits.flush(self.id)
+        base = self.json()
+        self.do_edit(**attrs)
+        self.commit(base, attrs.keys(), author=self.app.user)
+        self.app.activity.publish(Event.create('editable-edit', self, app=self.app))
+
+    def commit(self, base, attrs, author=None, keep_concurrent=False):
+        """Write the modified *attrs* of the object to the database.
+
+        *base* is the JSON representation the modifications are based on. *author* is added to the
+        authors, if any. If *keep_concurrent* is ``True``, attributes which have been written
+        concurrently keep the stored value instead of raising a :exc:`ConflictError`, and the list
+        of them is returned. Afterwards the object reflects the stored state, including concurrent
+        changes to other attributes. If the write fails, the object is reloaded from the database.
+
+        Pending edits of the object (see :class:`EditCoalescer`) must be stored before the
+        modifications are made.
+        """
+        local = self.json()
+        current = {}
+
+        def _merge(p):
+            r = JSONRedis(p)
+            r.caching = False
+            current.clear()
+            current.update(r.oget(self.id))
+            conflicts = []
+            if current['version'] != base['version']:
+                conflicts = [a for a in attrs if local[a] != current[a] != base[a]]
+                if conflicts and not keep_concurrent:
+                    raise ConflictError(current['version'], conflicts)
+            for attr in attrs:
+                if attr not in conflicts:
+                    current[attr] = local[attr]
+            if author and author.id not in current['authors']:
+                current['authors'].append(author.id)
+            current['version'] += 1
+            p.multi()
+            r.oset(self.id, current)
+            return conflicts
+
+        try:
+            conflicts = self.app.transaction(_merge, self.id)
+        except ConflictError as e:
+            if e.version is None:
+                e.version = current.get('version')
+            self.reload()
+            raise
+        self._load(current)
+        return conflicts
+
+    def reload(self):
+        """Reload the object from the database, discarding unstored modifications."""
+        r = JSONRedis(self.app.r.r)
+        r.caching = False
+        self._load(r.oget(self.id))
+
+    def _load(self, json):
+        args = dict(json)
+        del args['__type__']
+        self.__dict__.update(type(self)(app=self.app, **args).__dict__)
+
+    def json(self, restricted=False, include=False):
+        # pylint: disable=unused-argument; part of API
+        """Return a JSON object representation of the versioned part of the object."""
+        return {'version': self.version}
+
+class Meeting(Object, Versioned, Editable):
     """See :ref:`Meeting`.
 
     .. attribute:: items
@@ -110,9 +538,10 @@ class Meeting(Object, Editable):
        Ordered map of trashed (deleted) :class:`AgendaItem` s.
     """
 
-    def __init__(self, id, trashed, app, authors, title, time, location, description):
+    def __init__(self, id, trashed, app, authors, title, time, location, description, version):
         super().__init__(id=id, trashed=trashed, app=app)
         Editable.__init__(self, authors=authors)
+        Versioned.__init__(self, version=version)
         self.title = title
         self.time = parse_isotime(time) if time else None
         self.location = location
@@ -120,8 +549,8 @@ class Meeting(Object, Editable):
 
         self._items_key = self.id + '.items'
         self._trashed_items_key = self.id + '.trashed_items'
-        self.items = JSONRedisMapping(self.app.r, self._items_key)
-        self.trashed_items = JSONRedisMapping(self.app.r, self._trashed_items_key)
+        self.items = _EditedMapping(self.app, self._items_key)
+        self.trashed_items = _EditedMapping(self.app, self._trashed_items_key)
 
     def do_edit(self, **attrs):
         e = InputError()
@@ -153,7 +582,8 @@ class Meeting(Object, Editable):
 
         item = AgendaItem(
             id='AgendaItem:' + randstr(), trashed=False, app=self.app, authors=[self.app.user.id],
-            title=title, duration=duration, description=description)
+            title=title, duration=duration, description=description, version=0)
+        self.app.r.hset('agenda_item_meetings', item.id, self.id)
         self.app.r.oset(item.id, item)
         self.app.r.rpush(self._items_key, item.id)
         return item
@@ -163,31 +593,46 @@ class Meeting(Object, Editable):
         if not self.app.r.lrem(self._items_key, 1, item.id):
             raise ValueError('item_not_found')
         self.app.r.rpush(self._trashed_items_key, item.id)
+        self.app.edits.flush(item.id)
+        base = item.json()
         item.trashed = True
-        self.app.r.oset(item.id, item)
+        item.commit(base, ['trashed'])
 
     def restore_agenda_item(self, item):
         """See :http:post:`/api/meetings/(id)/restore-agenda-item`."""
         if not self.app.r.lrem(self._trashed_items_key, 1, item.id):
             raise ValueError('item_not_found')
         self.app.r.rpush(self._items_key, item.id)
+        self.app.edits.flush(item.id)
+        base = item.json()
         item.trashed = False
-        self.app.r.oset(item.id, item)
+        item.commit(base, ['trashed'])
 
     def move_agenda_item(self, item, to):
-        """See :http:post:`/api/meetings/(id)/move-agenda-item`."""
-        if to:
+        """See :http:post:`/api/meetings/(id)/move-agenda-item`.
+
+        The agenda is modified atomically, concurrent moves are retried (see
+        :meth:`Meetling.transaction`).
+        """
+        def _move(p):
+            ids = [id.decode() for id in p.lrange(self._items_key, 0, -1)]
+            if to and to.id not in ids:
+                raise ValueError('to_not_found')
+            if item.id not in ids:
+                raise ValueError('item_not_found')
+            p.multi()
+            p.lrem(self._items_key, 1, item.id)
+            if to:
+                p.linsert(self._items_key, 'after', to.id, item.id)
+            else:
+                p.lpush(self._items_key, item.id)
+
+        if to == item:
             if to.id not in self.items:
                 raise ValueError('to_not_found')
-            if to == item:
-                # No op
-                return
-        if not self.app.r.lrem(self._items_key, 1, item.id):
-            raise ValueError('item_not_found')
-        if to:
-            self.app.r.linsert(self._items_key, 'after', to.id, item.id)
-        else:
-            self.app.r.lpush(self._items_key, item.id)
+            # No op
+            return
+        self.app.transaction(_move, self._items_key)
 
     def json(self, restricted=False, include=False):
         """See :meth:`Object.json`.
@@ -196,6 +641,7 @@ class Meeting(Object, Editable):
         """
         json = super().json(restricted=restricted, include=include)
         json.update(Editable.json(self, restricted=restricted, include=include))
+        json.update(Versioned.json(self, restricted=restricted, include=include))
         json.update({
             'title': self.title,
             'time': self.time.isoformat() + 'Z' if self.time else None,
@@ -209,12 +655,13 @@ class Meeting(Object, Editable):
                                      for i in self.trashed_items.values()]
         return json
 
-class AgendaItem(Object, Editable):
+class AgendaItem(Object, Versioned, Editable):
     """See :ref:`AgendaItem`."""
 
-    def __init__(self, id, trashed, app, authors, title, duration, description):
+    def __init__(self, id, trashed, app, authors, title, duration, description, version):
         super().__init__(id=id, trashed=trashed, app=app)
         Editable.__init__(self, authors=authors)
+        Versioned.__init__(self, version=version)
         self.title = title
         self.duration = duration
         self.description = description
@@ -237,6 +684,7 @@ class AgendaItem(Object, Editable):
     def json(self, restricted=False, include=False):
         json = super().json(restricted=restricted, include=include)
         json.update(Editable.json(self, restricted=restricted, include=include))
+        json.update(Versioned.json(self, restricted=restricted, include=include))
         json.update({
             'title': self.title,
             'duration': self.duration,
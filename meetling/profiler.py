@@ -0,0 +1,103 @@
+# Meetling
+# Copyright (C) 2017 Meetling contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""Sampling profiler for requests."""
+
+from collections import Counter
+from random import random
+import signal
+
+class Profiler:
+    """Sampling profiler for requests.
+
+    A random *fraction* of requests is profiled. While a request is profiled, the stack of the
+    running thread is sampled every *interval* seconds of wall-clock time, so that time waiting for
+    the database is included. Stacks are aggregated per endpoint.
+
+    Sampling relies on ``SIGALRM``, thus requests must be handled on the main thread. Requests not
+    selected for profiling only cost a random number.
+
+    .. attribute:: fraction
+
+       Fraction of requests to profile, between ``0`` and ``1``. ``0`` disables the profiler.
+       ``None`` is treated as ``0``.
+
+    .. attribute:: interval
+
+       Sampling interval in seconds.
+
+    .. attribute:: requests
+
+       Number of profiled requests.
+
+    .. attribute:: stacks
+
+       :class:`Counter` of samples per stack. A stack is a string of the endpoint and the frames,
+       from the outermost to the innermost, separated by ``;``.
+    """
+
+    def __init__(self, fraction=0, interval=0.001):
+        self.fraction = fraction or 0
+        self.interval = interval
+        self.requests = 0
+        self.stacks = Counter()
+        self._endpoint = None
+        self._previous_handler = None
+
+    def start(self, endpoint):
+        """Start profiling a request to *endpoint*, if it is selected.
+
+        Return ``True`` if the request is profiled, ``False`` otherwise.
+        """
+        if self._endpoint or not self.fraction or random() >= self.fraction:
+            return False
+        self._endpoint = endpoint
+        self._previous_handler = signal.signal(signal.SIGALRM, self._sample)
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+        return True
+
+    def stop(self):
+        """Stop profiling the current request, if any."""
+        if not self._endpoint:
+            return
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self._previous_handler)
+        self._previous_handler = None
+        self._endpoint = None
+        self.requests += 1
+
+    def reset(self):
+        """Discard all samples."""
+        self.requests = 0
+        self.stacks.clear()
+
+    def folded(self):
+        """Return the samples in the folded stack format.
+
+        The output can be rendered with flame graph tools, e.g. ``flamegraph.pl``.
+        """
+        return ''.join('{} {}\n'.format(stack, count)
+                       for stack, count in sorted(self.stacks.items()))
+
+    def _sample(self, signum, frame):
+        # pylint: disable=unused-argument; signal handler
+        if not self._endpoint:
+            return
+        frames = []
+        while frame:
+            frames.append('{}.{}'.format(frame.f_globals.get('__name__', '?'),
+                                         frame.f_code.co_name))
+            frame = frame.f_back
+        frames.append(self._endpoint)
+        self.stacks[';'.join(reversed(frames))] += 1
@@ -17,19 +17,43 @@
 
 """Meetling server core."""
 
+import atexit
 import http.client
 import json
 
 import micro
 from micro.server import Server, Endpoint
 from micro.util import parse_isotime
+from tornado.ioloop import PeriodicCallback
 from tornado.web import HTTPError
 
-from meetling import Meetling
-
-def make_server(port=8080, url=None, client_path='client', debug=False, redis_url='', smtp_url=''):
-    """Create a Meetling server."""
-    app = Meetling(redis_url, smtp_url=smtp_url)
+from meetling import Meetling, ConflictError
+from meetling.profiler import Profiler
+from meetling.storage import MemoryRedis
+
+def make_server(port=8080, url=None, client_path='client', debug=False, redis_url='', smtp_url='',
+                edit_window=2, shard_urls=[], snapshot_interval=60, profile=0):
+    """Create a Meetling server.
+
+    Edits of meetings and agenda items are coalesced within *edit_window* seconds (see
+    :class:`meetling.EditCoalescer`). Meetings are distributed across the Redis databases given by
+    *shard_urls* (see :class:`meetling.sharding.ShardedRedis`).
+
+    If an embedded in-memory database is snapshotted to a file, a snapshot is written every
+    *snapshot_interval* seconds and on exit. Pending edits are stored on exit as well. When run as
+    script, the server exits on ``SIGTERM`` (see :func:`meetling.__main__.main`).
+
+    The fraction *profile* of requests to the Meetling endpoints is profiled by the
+    :class:`meetling.profiler.Profiler` *app.profiler*.
+    """
+    app = Meetling(redis_url, smtp_url=smtp_url, edit_window=edit_window, shard_urls=shard_urls)
+    app.profiler = Profiler(fraction=profile)
+    storage = app.r.r.primary
+    if isinstance(storage, MemoryRedis) and storage.path:
+        PeriodicCallback(storage.save, snapshot_interval * 1000).start()
+        atexit.register(storage.save)
+    # Store pending edits on exit (before the snapshot, as exit functions run in reverse order)
+    atexit.register(app.edits.flush)
     handlers = [
         (r'/api/meetings$', _MeetingsEndpoint),
         (r'/api/create-example-meeting$', _CreateExampleMeetingEndpoint),
@@ -38,11 +62,39 @@ def make_server(port=8080, url=None, client_path='client', debug=False, redis_ur
         (r'/api/meetings/([^/]+)/trash-agenda-item$', _MeetingTrashAgendaItemEndpoint),
         (r'/api/meetings/([^/]+)/restore-agenda-item$', _MeetingRestoreAgendaItemEndpoint),
         (r'/api/meetings/([^/]+)/move-agenda-item$', _MeetingMoveAgendaItemEndpoint),
-        (r'/api/meetings/([^/]+)/items/([^/]+)$', _AgendaItemEndpoint)
+        (r'/api/meetings/([^/]+)/items/([^/]+)$', _AgendaItemEndpoint),
+        (r'/api/profiler$', _ProfilerEndpoint),
+        (r'/api/profiler/stacks$', _ProfilerStacksEndpoint)
     ]
     return Server(app, handlers, port, url, client_path, 'node_modules', debug)
 
-class _MeetingsEndpoint(Endpoint):
+class _Endpoint(Endpoint):
+    def prepare(self):
+        self.app.profiler.start('{} {}'.format(self.request.method, type(self).__name__[1:]))
+        super().prepare()
+
+    def on_finish(self):
+        self.app.profiler.stop()
+        super().on_finish()
+
+    def check_staff(self):
+        if self.app.user not in self.app.settings.staff:
+            raise micro.PermissionError()
+
+    def write_error(self, status_code, **kwargs):
+        exc = kwargs.get('exc_info', (None, None, None))[1]
+        if isinstance(exc, ConflictError):
+            self.set_status(http.client.CONFLICT)
+            self.write({
+                '__type__': type(exc).__name__,
+                'code': exc.code,
+                'version': exc.version,
+                'conflicts': exc.conflicts
+            })
+        else:
+            super().write_error(status_code, **kwargs)
+
+class _MeetingsEndpoint(_Endpoint):
     def post(self):
         args = self.check_args({
             'title': str,
@@ -59,12 +111,12 @@ class _MeetingsEndpoint(Endpoint):
         meeting = self.app.create_meeting(**args)
         self.write(meeting.json(restricted=True, include=True))
 
-class _CreateExampleMeetingEndpoint(Endpoint):
+class _CreateExampleMeetingEndpoint(_Endpoint):
     def post(self):
         meeting = self.app.create_example_meeting()
         self.write(meeting.json(restricted=True, include=True))
 
-class _MeetingEndpoint(Endpoint):
+class _MeetingEndpoint(_Endpoint):
     def get(self, id):
         meeting = self.app.meetings[id]
         self.write(meeting.json(restricted=True, include=True))
@@ -86,7 +138,7 @@ class _MeetingEndpoint(Endpoint):
         meeting.edit(**args)
         self.write(meeting.json(restricted=True, include=True))
 
-class _MeetingItemsEndpoint(Endpoint):
+class _MeetingItemsEndpoint(_Endpoint):
     def get(self, id, set):
         meeting = self.app.meetings[id]
         items = meeting.trashed_items.values() if set else meeting.items.values()
@@ -104,7 +156,7 @@ class _MeetingItemsEndpoint(Endpoint):
         item = meeting.create_agenda_item(**args)
         self.write(item.json(restricted=True, include=True))
 
-class _MeetingTrashAgendaItemEndpoint(Endpoint):
+class _MeetingTrashAgendaItemEndpoint(_Endpoint):
     def post(self, id):
         args = self.check_args({'item_id': str})
         meeting = self.app.meetings[id]
@@ -116,7 +168,7 @@ class _MeetingTrashAgendaItemEndpoint(Endpoint):
         meeting.trash_agenda_item(**args)
         self.write(json.dumps(None))
 
-class _MeetingRestoreAgendaItemEndpoint(Endpoint):
+class _MeetingRestoreAgendaItemEndpoint(_Endpoint):
     def post(self, id):
         args = self.check_args({'item_id': str})
         meeting = self.app.meetings[id]
@@ -128,7 +180,7 @@ class _MeetingRestoreAgendaItemEndpoint(Endpoint):
         meeting.restore_agenda_item(**args)
         self.write(json.dumps(None))
 
-class _MeetingMoveAgendaItemEndpoint(Endpoint):
+class _MeetingMoveAgendaItemEndpoint(_Endpoint):
     def post(self, id):
         args = self.check_args({'item_id': str, 'to_id': (str, None)})
         meeting = self.app.meetings[id]
@@ -146,7 +198,7 @@ class _MeetingMoveAgendaItemEndpoint(Endpoint):
         meeting.move_agenda_item(**args)
         self.write(json.dumps(None))
 
-class _AgendaItemEndpoint(Endpoint):
+class _AgendaItemEndpoint(_Endpoint):
     def get(self, meeting_id, item_id):
         meeting = self.app.meetings[meeting_id]
         item = meeting.items[item_id]
@@ -162,3 +214,32 @@ class _AgendaItemEndpoint(Endpoint):
         item = meeting.items[item_id]
         item.edit(**args)
         self.write(item.json(restricted=True, include=True))
+
+class _ProfilerEndpoint(_Endpoint):
+    def get(self):
+        self.check_staff()
+        profiler = self.app.profiler
+        self.write({
+            'fraction': profiler.fraction,
+            'requests': profiler.requests,
+            'samples': sum(profiler.stacks.values())
+        })
+
+    def post(self):
+        self.check_staff()
+        args = self.check_args({'fraction': (float, int), 'reset': (bool, 'opt')})
+        # bool is a subclass of int
+        if isinstance(args['fraction'], bool):
+            raise micro.InputError({'fraction': 'bad_type'})
+        if not 0 <= args['fraction'] <= 1:
+            raise micro.InputError({'fraction': 'out_of_range'})
+        self.app.profiler.fraction = args['fraction']
+        if args.get('reset'):
+            self.app.profiler.reset()
+        self.get()
+
+class _ProfilerStacksEndpoint(_Endpoint):
+    def get(self):
+        self.check_staff()
+        self.set_header('Content-Type', 'text/plain; charset=UTF-8')
+        self.write(self.app.profiler.folded())
@@ -0,0 +1,172 @@
+# Meetling
+# Copyright (C) 2017 Meetling contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""Sharding of meetings across multiple Redis nodes."""
+
+from collections import OrderedDict
+from hashlib import sha1
+from logging import getLogger
+
+from meetling.storage import connect
+
+_logger = getLogger(__name__)
+
+class ShardedRedis:
+    """Redis client distributing meetings across multiple Redis nodes.
+
+    Meeting-scoped keys, i.e. ``Meeting:<id>``, ``Meeting:<id>.items``,
+    ``Meeting:<id>.trashed_items`` and the keys of the meeting's agenda items, are stored on one of
+    the *shards*, selected by rendezvous hashing of the meeting ID. All other keys, including the
+    map of agenda items to meetings ``agenda_item_meetings``, are stored on the *primary* node.
+
+    *primary* is the :class:`StrictRedis` client of the primary node. *shards* is a list of database
+    URLs (see :func:`meetling.storage.connect`). If it is empty, all keys are stored on the primary
+    node.
+
+    Commands with a key as first argument, as well as :meth:`mget` and :meth:`mset`, are routed to
+    the responsible node. Commands without arguments are sent to the primary node.
+
+    .. attribute:: primary
+
+       :class:`StrictRedis` client of the primary node.
+
+    .. attribute:: shards
+
+       Ordered map of shard URLs to :class:`StrictRedis` clients.
+    """
+
+    def __init__(self, primary, shards=[]):
+        self.primary = primary
+        self.shards = OrderedDict((url, connect(url)) for url in shards)
+        # Agenda items never move to another meeting, so the map can be cached indefinitely
+        self._item_meetings = {}
+
+    def node(self, key):
+        """Return the client of the node responsible for *key*."""
+        if not self.shards:
+            return self.primary
+        return self.node_for_tag(self._tags([key])[0])
+
+    def node_for_tag(self, tag):
+        """Return the client of the node responsible for the meeting with the ID *tag*.
+
+        If *tag* is ``None``, the primary node is returned.
+        """
+        if not self.shards or tag is None:
+            return self.primary
+        return self.shards[max(self.shards, key=lambda url: _hash(url + tag))]
+
+    def mget(self, keys, *args):
+        """See :meth:`StrictRedis.mget`."""
+        keys = list(keys) + list(args) if isinstance(keys, (list, tuple)) else [keys] + list(args)
+        if not self.shards:
+            return self.primary.mget(keys)
+
+        groups = OrderedDict()
+        for i, tag in enumerate(self._tags(keys)):
+            groups.setdefault(self.node_for_tag(tag), []).append(i)
+        values = [None] * len(keys)
+        for node, indices in groups.items():
+            for i, value in zip(indices, node.mget([keys[i] for i in indices])):
+                values[i] = value
+        return values
+
+    def mset(self, mapping):
+        """See :meth:`StrictRedis.mset`.
+
+        Across nodes, the operation is not atomic.
+        """
+        if not self.shards:
+            return self.primary.mset(mapping)
+
+        keys = list(mapping)
+        groups = OrderedDict()
+        for key, tag in zip(keys, self._tags(keys)):
+            groups.setdefault(self.node_for_tag(tag), {})[key] = mapping[key]
+        for node, group in groups.items():
+            node.mset(group)
+        return True
+
+    def flushdb(self):
+        """See :meth:`StrictRedis.flushdb`.
+
+        All nodes are flushed.
+        """
+        self._item_meetings.clear()
+        for node in [self.primary] + list(self.shards.values()):
+            node.flushdb()
+        return True
+
+    def rebalance(self):
+        """Move meetings to the node responsible for them.
+
+        Must be run after shards have been added, while all servers are stopped. A meeting with keys
+        that already exist on the responsible node is not moved, so that no data is overwritten,
+        and a warning is logged. Return the number of moved meetings.
+        """
+        nodes = [self.primary] + list(self.shards.values())
+        count = 0
+        for tag in (id.decode() for id in self.primary.lrange('meetings', 0, -1)):
+            target = self.node_for_tag(tag)
+            source = next((n for n in nodes if n is not target and n.exists(tag)), None)
+            if not source:
+                continue
+
+            keys = [tag, tag + '.items', tag + '.trashed_items']
+            keys += [k.decode() for k in source.lrange(keys[1], 0, -1)]
+            keys += [k.decode() for k in source.lrange(keys[2], 0, -1)]
+            if target.exists(*keys):
+                _logger.warning('Skipped %s, which is partially stored on the target node', tag)
+                continue
+            p = target.pipeline()
+            for key in keys:
+                data = source.dump(key)
+                if data is not None:
+                    p.restore(key, 0, data)
+            p.execute()
+            source.delete(*keys)
+            count += 1
+            _logger.info('Moved %s (%d keys)', tag, len(keys))
+        return count
+
+    def _tags(self, keys):
+        keys = [k.decode() if isinstance(k, bytes) else k for k in keys]
+        missing = [k for k in keys
+                   if k.startswith('AgendaItem:') and k not in self._item_meetings]
+        if missing and self.shards:
+            for key, meeting_id in zip(missing, self.primary.hmget('agenda_item_meetings',
+                                                                   missing)):
+                if meeting_id:
+                    self._item_meetings[key] = meeting_id.decode()
+
+        tags = []
+        for key in keys:
+            if key.startswith('Meeting:'):
+                tags.append(key.split('.', 1)[0])
+            elif key.startswith('AgendaItem:'):
+                tags.append(self._item_meetings.get(key))
+            else:
+                tags.append(None)
+        return tags
+
+    def __getattr__(self, name):
+        def _call(*args, **kwargs):
+            key = args[0] if args and isinstance(args[0], (str, bytes)) else None
+            node = self.node(key) if key else self.primary
+            return getattr(node, name)(*args, **kwargs)
+        return _call
+
+def _hash(s):
+    # Well-mixed 64 bit hash, so that the ranking of shards is uniform
+    return int.from_bytes(sha1(s.encode()).digest()[:8], 'big')
@@ -0,0 +1,583 @@
+# Meetling
+# Copyright (C) 2017 Meetling contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <http://www.gnu.org/licenses/>.
+
+"""Storage backends.
+
+Meetling stores its data in Redis, but may alternatively use :class:`MemoryRedis`, an embedded
+in-memory implementation of the Redis commands used by the application.
+"""
+
+from datetime import timedelta
+from fnmatch import fnmatchcase
+from functools import wraps
+import os
+import pickle
+from threading import RLock
+from time import time as unix_time
+from urllib.parse import urlparse
+
+from redis import StrictRedis
+from redis.exceptions import ResponseError, WatchError
+
+_stores = {}
+
+def connect(url):
+    """Connect to the database at *url*.
+
+    *url* is either the URL of a Redis database (see :meth:`StrictRedis.from_url`), or refers to a
+    :class:`MemoryRedis`:
+
+    * ``memory:`` creates a new, private store
+    * ``memory:<name>`` connects to the store with *name*, shared within the process
+    * ``file:<path>`` connects to the store which is snapshotted to the file at *path*, shared
+      within the process
+    """
+    scheme = urlparse(url).scheme
+    if scheme == 'memory':
+        name = url[len('memory:'):]
+        if not name:
+            return MemoryRedis()
+        return _stores.setdefault(url, MemoryRedis())
+    if scheme == 'file':
+        path = urlparse(url).path
+        if url not in _stores:
+            _stores[url] = MemoryRedis(path)
+        return _stores[url]
+    return StrictRedis.from_url(url)
+
+def _locked(func):
+    # pylint: disable=protected-access; decorator for MemoryRedis methods
+    @wraps(func)
+    def _wrapper(self, *args, **kwargs):
+        with self._lock:
+            self._expire()
+            return func(self, *args, **kwargs)
+    return _wrapper
+
+def _key(key):
+    return key.decode() if isinstance(key, bytes) else key
+
+def _value(value):
+    if isinstance(value, bytes):
+        return value
+    return str(value).encode()
+
+def _seconds(value):
+    return value.total_seconds() if isinstance(value, timedelta) else value
+
+class MemoryRedis:
+    """In-memory Redis database.
+
+    Implements the commands for strings, lists, hashes and sets used by Meetling and micro with the
+    interface of :class:`StrictRedis`, including transactions (see :meth:`pipeline`) and key
+    expiration. Like with Redis, expired keys are removed lazily, on the next access. Access is
+    thread-safe.
+
+    If *path* is given, the data is loaded from the snapshot file at *path*, if it exists, and
+    :meth:`save` writes a snapshot to it.
+
+    .. attribute:: path
+
+       Path of the snapshot file. May be ``None``.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._data = {}
+        # Expiration time of volatile keys, as Unix time, and the earliest one
+        self._expires = {}
+        self._next_expire = float('inf')
+        self._versions = {}
+        self._epoch = 0
+        self._lock = RLock()
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self._data, self._expires = pickle.load(f)
+            self._next_expire = min(self._expires.values(), default=float('inf'))
+
+    @_locked
+    def save(self):
+        """Write a snapshot of the data to :attr:`path`."""
+        if not self.path:
+            raise ValueError('path_none')
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump((self._data, self._expires), f)
+        os.replace(tmp, self.path)
+        return True
+
+    @_locked
+    def watch_versions(self, names):
+        """Return the current versions of the keys *names*, used by :meth:`MemoryPipeline.watch`.
+
+        The version of a key changes whenever the key is modified.
+        """
+        return {_key(name): (self._epoch, self._versions.get(_key(name), 0)) for name in names}
+
+    @_locked
+    def execute_commands(self, commands, versions=None):
+        """Execute the list of *commands* atomically and return their results.
+
+        A command is a tuple of the method name, positional and keyword arguments. If *versions* of
+        watched keys, as returned by :meth:`watch_versions`, are given and any of the keys has been
+        modified since, :exc:`WatchError` is raised.
+        """
+        if versions and self.watch_versions(versions) != versions:
+            raise WatchError('Watched variable changed.')
+        return [getattr(self, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+    def pipeline(self, transaction=True):
+        # pylint: disable=unused-argument; part of API
+        """See :meth:`StrictRedis.pipeline`."""
+        return MemoryPipeline(self)
+
+    def ping(self):
+        """See :meth:`StrictRedis.ping`."""
+        return True
+
+    @_locked
+    def flushdb(self):
+        """See :meth:`StrictRedis.flushdb`."""
+        self._data.clear()
+        self._expires.clear()
+        self._next_expire = float('inf')
+        self._versions.clear()
+        self._epoch += 1
+        return True
+
+    flushall = flushdb
+
+    @_locked
+    def exists(self, *names):
+        """See :meth:`StrictRedis.exists`."""
+        return sum(1 for name in names if _key(name) in self._data)
+
+    @_locked
+    def delete(self, *names):
+        """See :meth:`StrictRedis.delete`."""
+        count = 0
+        for name in map(_key, names):
+            if self._data.pop(name, None) is not None:
+                self._expires.pop(name, None)
+                self._touch(name)
+                count += 1
+        return count
+
+    @_locked
+    def expire(self, name, time):
+        """See :meth:`StrictRedis.expire`."""
+        return self.pexpire(name, _seconds(time) * 1000)
+
+    @_locked
+    def pexpire(self, name, time):
+        """See :meth:`StrictRedis.pexpire`."""
+        name = _key(name)
+        if name not in self._data:
+            return False
+        self._set_expire(name, _seconds(time) / 1000)
+        self._touch(name)
+        return True
+
+    @_locked
+    def ttl(self, name):
+        """See :meth:`StrictRedis.ttl`."""
+        name = _key(name)
+        if name not in self._data:
+            return -2
+        if name not in self._expires:
+            return -1
+        return round(self._expires[name] - unix_time())
+
+    @_locked
+    def keys(self, pattern='*'):
+        """See :meth:`StrictRedis.keys`."""
+        pattern = _key(pattern)
+        return [k.encode() for k in self._data if fnmatchcase(k, pattern)]
+
+    def scan_iter(self, match=None, count=None):
+        # pylint: disable=unused-argument; part of API
+        """See :meth:`StrictRedis.scan_iter`."""
+        with self._lock:
+            self._expire()
+            keys = list(self._data)
+        for key in keys:
+            if match is None or fnmatchcase(key, _key(match)):
+                yield key.encode()
+
+    @_locked
+    def type(self, name):
+        """See :meth:`StrictRedis.type`."""
+        value = self._data.get(_key(name))
+        types = {bytes: b'string', list: b'list', dict: b'hash', set: b'set'}
+        return types[type(value)] if value is not None else b'none'
+
+    @_locked
+    def dump(self, name):
+        """See :meth:`StrictRedis.dump`."""
+        value = self._data.get(_key(name))
+        return pickle.dumps(value) if value is not None else None
+
+    @_locked
+    def restore(self, name, ttl, value, replace=False):
+        """See :meth:`StrictRedis.restore`."""
+        name = _key(name)
+        if name in self._data and not replace:
+            raise ResponseError('BUSYKEY Target key name already exists.')
+        self._data[name] = pickle.loads(value)
+        self._expires.pop(name, None)
+        if ttl:
+            self._set_expire(name, ttl / 1000)
+        self._touch(name)
+        return True
+
+    # Strings
+
+    @_locked
+    def get(self, name):
+        """See :meth:`StrictRedis.get`."""
+        return self._get(name, bytes)
+
+    @_locked
+    def mget(self, keys, *args):
+        """See :meth:`StrictRedis.mget`."""
+        keys = list(keys) + list(args) if isinstance(keys, (list, tuple)) else [keys] + list(args)
+        values = [self._data.get(_key(k)) for k in keys]
+        return [value if isinstance(value, bytes) else None for value in values]
+
+    @_locked
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False):
+        """See :meth:`StrictRedis.set`."""
+        name = _key(name)
+        if (nx and name in self._data) or (xx and name not in self._data):
+            return None
+        self._data[name] = _value(value)
+        self._expires.pop(name, None)
+        if ex is not None:
+            self._set_expire(name, _seconds(ex))
+        if px is not None:
+            self._set_expire(name, _seconds(px) / 1000)
+        self._touch(name)
+        return True
+
+    @_locked
+    def setnx(self, name, value):
+        """See :meth:`StrictRedis.setnx`."""
+        return bool(self.set(name, value, nx=True))
+
+    @_locked
+    def mset(self, *args, **kwargs):
+        """See :meth:`StrictRedis.mset`."""
+        mapping = dict(args[0]) if args else {}
+        mapping.update(kwargs)
+        for name, value in mapping.items():
+            self.set(name, value)
+        return True
+
+    @_locked
+    def incrby(self, name, amount=1):
+        """See :meth:`StrictRedis.incrby`."""
+        value = int(self._get(name, bytes) or 0) + amount
+        self.set(name, value)
+        return value
+
+    incr = incrby
+
+    # Lists
+
+    @_locked
+    def llen(self, name):
+        """See :meth:`StrictRedis.llen`."""
+        return len(self._get(name, list) or [])
+
+    @_locked
+    def lrange(self, name, start, end):
+        """See :meth:`StrictRedis.lrange`."""
+        items = self._get(name, list) or []
+        end = len(items) if end == -1 else end + 1
+        return items[start:end]
+
+    @_locked
+    def lindex(self, name, index):
+        """See :meth:`StrictRedis.lindex`."""
+        items = self._get(name, list) or []
+        return items[index] if -len(items) <= index < len(items) else None
+
+    @_locked
+    def lpush(self, name, *values):
+        """See :meth:`StrictRedis.lpush`."""
+        items = self._get(name, list, create=True)
+        for value in values:
+            items.insert(0, _value(value))
+        self._touch(name)
+        return len(items)
+
+    @_locked
+    def rpush(self, name, *values):
+        """See :meth:`StrictRedis.rpush`."""
+        items = self._get(name, list, create=True)
+        items.extend(_value(v) for v in values)
+        self._touch(name)
+        return len(items)
+
+    @_locked
+    def lpop(self, name):
+        """See :meth:`StrictRedis.lpop`."""
+        return self._pop(name, 0)
+
+    @_locked
+    def rpop(self, name):
+        """See :meth:`StrictRedis.rpop`."""
+        return self._pop(name, -1)
+
+    @_locked
+    def lrem(self, name, count, value):
+        """See :meth:`StrictRedis.lrem`."""
+        items = self._get(name, list) or []
+        value = _value(value)
+        indices = [i for i, item in enumerate(items) if item == value]
+        if count < 0:
+            indices = list(reversed(indices))[:-count]
+        elif count > 0:
+            indices = indices[:count]
+        for i in sorted(indices, reverse=True):
+            del items[i]
+        if indices:
+            self._cleanup(name)
+            self._touch(name)
+        return len(indices)
+
+    @_locked
+    def linsert(self, name, where, refvalue, value):
+        """See :meth:`StrictRedis.linsert`."""
+        items = self._get(name, list)
+        if items is None:
+            return 0
+        try:
+            i = items.index(_value(refvalue))
+        except ValueError:
+            return -1
+        items.insert(i + 1 if where.lower() == 'after' else i, _value(value))
+        self._touch(name)
+        return len(items)
+
+    @_locked
+    def ltrim(self, name, start, end):
+        """See :meth:`StrictRedis.ltrim`."""
+        items = self._get(name, list) or []
+        items[:] = self.lrange(name, start, end)
+        self._cleanup(name)
+        self._touch(name)
+        return True
+
+    # Hashes
+
+    @_locked
+    def hget(self, name, key):
+        """See :meth:`StrictRedis.hget`."""
+        return (self._get(name, dict) or {}).get(_value(key))
+
+    @_locked
+    def hmget(self, name, keys, *args):
+        """See :meth:`StrictRedis.hmget`."""
+        keys = list(keys) + list(args) if isinstance(keys, (list, tuple)) else [keys] + list(args)
+        fields = self._get(name, dict) or {}
+        return [fields.get(_value(k)) for k in keys]
+
+    @_locked
+    def hgetall(self, name):
+        """See :meth:`StrictRedis.hgetall`."""
+        return dict(self._get(name, dict) or {})
+
+    @_locked
+    def hkeys(self, name):
+        """See :meth:`StrictRedis.hkeys`."""
+        return list(self._get(name, dict) or {})
+
+    @_locked
+    def hexists(self, name, key):
+        """See :meth:`StrictRedis.hexists`."""
+        return _value(key) in (self._get(name, dict) or {})
+
+    @_locked
+    def hlen(self, name):
+        """See :meth:`StrictRedis.hlen`."""
+        return len(self._get(name, dict) or {})
+
+    @_locked
+    def hset(self, name, key, value):
+        """See :meth:`StrictRedis.hset`."""
+        fields = self._get(name, dict, create=True)
+        new = _value(key) not in fields
+        fields[_value(key)] = _value(value)
+        self._touch(name)
+        return int(new)
+
+    @_locked
+    def hmset(self, name, mapping):
+        """See :meth:`StrictRedis.hmset`."""
+        for key, value in mapping.items():
+            self.hset(name, key, value)
+        return True
+
+    @_locked
+    def hdel(self, name, *keys):
+        """See :meth:`StrictRedis.hdel`."""
+        fields = self._get(name, dict) or {}
+        count = sum(1 for k in keys if fields.pop(_value(k), None) is not None)
+        if count:
+            self._cleanup(name)
+            self._touch(name)
+        return count
+
+    # Sets
+
+    @_locked
+    def sadd(self, name, *values):
+        """See :meth:`StrictRedis.sadd`."""
+        members = self._get(name, set, create=True)
+        count = len(members)
+        members.update(_value(v) for v in values)
+        self._touch(name)
+        return len(members) - count
+
+    @_locked
+    def srem(self, name, *values):
+        """See :meth:`StrictRedis.srem`."""
+        members = self._get(name, set) or set()
+        count = len(members)
+        members.difference_update(_value(v) for v in values)
+        self._cleanup(name)
+        self._touch(name)
+        return count - len(members)
+
+    @_locked
+    def smembers(self, name):
+        """See :meth:`StrictRedis.smembers`."""
+        return set(self._get(name, set) or set())
+
+    @_locked
+    def sismember(self, name, value):
+        """See :meth:`StrictRedis.sismember`."""
+        return _value(value) in (self._get(name, set) or set())
+
+    @_locked
+    def scard(self, name):
+        """See :meth:`StrictRedis.scard`."""
+        return len(self._get(name, set) or set())
+
+    def _set_expire(self, name, seconds):
+        expires = unix_time() + seconds
+        self._expires[name] = expires
+        self._next_expire = min(self._next_expire, expires)
+
+    def _expire(self):
+        now = unix_time()
+        if now < self._next_expire:
+            return
+        for name in [n for n, expires in self._expires.items() if expires <= now]:
+            del self._data[name]
+            del self._expires[name]
+            self._touch(name)
+        self._next_expire = min(self._expires.values(), default=float('inf'))
+
+    def _touch(self, name):
+        name = _key(name)
+        self._versions[name] = self._versions.get(name, 0) + 1
+
+    def _get(self, name, type, create=False):
+        name = _key(name)
+        value = self._data.get(name)
+        if value is None:
+            if create:
+                value = self._data[name] = type()
+            return value
+        if not isinstance(value, type):
+            raise ResponseError(
+                'WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    def _pop(self, name, index):
+        items = self._get(name, list)
+        if not items:
+            return None
+        value = items.pop(index)
+        self._cleanup(name)
+        self._touch(name)
+        return value
+
+    def _cleanup(self, name):
+        # Like Redis, remove empty containers
+        name = _key(name)
+        if not self._data.get(name, True):
+            del self._data[name]
+            self._expires.pop(name, None)
+
+class MemoryPipeline:
+    """Pipeline of a :class:`MemoryRedis`, see :meth:`StrictRedis.pipeline`.
+
+    After :meth:`watch`, commands are executed immediately until :meth:`multi` is called. Otherwise
+    commands are queued and executed atomically by :meth:`execute`.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._watched = None
+        self._queue = []
+        self._immediate = False
+
+    def watch(self, *names):
+        """See :meth:`StrictRedis.watch`."""
+        self._watched = self.store.watch_versions(names)
+        self._immediate = True
+        return True
+
+    def unwatch(self):
+        """See :meth:`StrictRedis.unwatch`."""
+        self._watched = None
+        return True
+
+    def multi(self):
+        """Start queueing commands."""
+        self._immediate = False
+
+    def execute(self):
+        """Execute the queued commands and return their results.
+
+        If a watched key has been modified, :exc:`WatchError` is raised.
+        """
+        try:
+            return self.store.execute_commands(self._queue, self._watched)
+        finally:
+            self.reset()
+
+    def reset(self):
+        """Discard queued commands and watched keys."""
+        self._watched = None
+        self._queue = []
+        self._immediate = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.reset()
+
+    def __getattr__(self, name):
+        func = getattr(self.store, name)
+        def _call(*args, **kwargs):
+            if self._immediate:
+                return func(*args, **kwargs)
+            self._queue.append((name, args, kwargs))
+            return self
+        return _call
@@ -0,0 +1,81 @@
+# Meetling
+# Copyright (C) 2017 Meetling contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <http://www.gnu.org/licenses/>.
+
+# pylint: disable=missing-docstring; test module
+
+from io import StringIO
+import os
+from tempfile import mkdtemp
+
+import micro
+
+from meetling import Meetling
+from meetling.__main__ import main
+from meetling.backup import export_data, import_data
+from meetling.storage import MemoryRedis
+from meetling.tests.test_meetling import MeetlingTestCase
+
+class BackupTest(MeetlingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.user = self.user
+        self.meeting = self.app.create_example_meeting()
+        self.meeting.trash_agenda_item(list(self.meeting.items.values())[0])
+        self.app.create_meeting('Cat hangout')
+
+    def test_export_import(self):
+        f = StringIO()
+        stats = export_data(self.app, f)
+        self.assertGreater(stats.objects, 0)
+
+        f.seek(0)
+        app = Meetling(redis_url='memory:',
+                       shard_urls=['memory:{}.{}'.format(self.id(), i) for i in range(2)])
+        import_data(app, f)
+        app.update()
+        self.assertEqual(list(app.meetings.values()), list(self.app.meetings.values()))
+        meeting = app.meetings[self.meeting.id]
+        self.assertEqual(list(meeting.items.values()), list(self.meeting.items.values()))
+        self.assertEqual(list(meeting.trashed_items.values()),
+                         list(self.meeting.trashed_items.values()))
+        self.assertEqual(app.authenticate(self.user.auth_secret), self.user)
+        self.assertEqual(app.settings.title, self.app.settings.title)
+
+    def test_main_import_file(self):
+        directory = mkdtemp()
+        path = os.path.join(directory, 'meetling.ndjson')
+        with open(path, 'w') as f:
+            export_data(self.app, f)
+        db_path = os.path.join(directory, 'meetling.db')
+        shard_path = os.path.join(directory, 'meetling.0.db')
+        main(['meetling', 'import', '--redis-url', 'file:' + db_path, '--shard-url',
+              'file:' + shard_path, path])
+
+        primary = MemoryRedis(db_path)
+        self.assertEqual(primary.llen('meetings'), 2)
+        self.assertTrue(MemoryRedis(shard_path).exists(self.meeting.id))
+
+    def test_import_database_not_empty(self):
+        with self.assertRaisesRegex(micro.ValueError, 'database_not_empty'):
+            import_data(self.app, StringIO())
+
+    def test_export_key_deleted(self):
+        r = self.app.r.r.primary
+        r.set('foo', 'bar')
+        keys = list(r.scan_iter())
+        r.delete('foo')
+        r.scan_iter = lambda: iter(keys)
+        f = StringIO()
+        export_data(self.app, f)
+        self.assertNotIn('"foo"', f.getvalue())
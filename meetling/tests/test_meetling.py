@@ -19,14 +19,16 @@ from subprocess import check_call, check_output
 from tempfile import mkdtemp
 
 import micro
-from tornado.testing import AsyncTestCase
+from tornado.gen import sleep
+from tornado.testing import AsyncTestCase, gen_test
 
-from meetling import Meetling
+from meetling import Meetling, AuthCache, ConflictError
 
 class MeetlingTestCase(AsyncTestCase):
     def setUp(self):
         super().setUp()
-        self.app = Meetling(redis_url='15')
+        self.redis_url = 'memory:' + self.id()
+        self.app = Meetling(redis_url=self.redis_url)
         self.app.r.flushdb()
         self.app.update()
         self.staff_member = self.app.login()
@@ -47,6 +49,64 @@ class MeetlingTest(MeetlingTestCase):
         meeting = self.app.create_example_meeting()
         self.assertTrue(len(meeting.items))
 
+    def test_authenticate_cached(self):
+        self.app.authenticate(self.user.auth_secret)
+        user = self.app.authenticate(self.user.auth_secret)
+        self.assertEqual(user, self.user)
+        self.assertEqual(self.app.user, self.user)
+        self.assertEqual(self.app.auth_cache.hits, 1)
+
+    def test_authenticate_user_edited(self):
+        user = self.app.authenticate(self.user.auth_secret)
+        user.edit(name='Happy')
+        user = self.app.authenticate(self.user.auth_secret)
+        self.assertEqual(user.name, 'Happy')
+        self.assertEqual(self.app.auth_cache.hits, 0)
+
+    def test_authenticate_login_user_edited(self):
+        user = self.app.login()
+        self.app.authenticate(user.auth_secret)
+        user.edit(name='Happy')
+        self.assertEqual(self.app.authenticate(user.auth_secret).name, 'Happy')
+        self.assertEqual(self.app.auth_cache.hits, 0)
+
+    def test_authenticate_secret_invalidated(self):
+        self.app.authenticate(self.staff_member.auth_secret)
+        self.app.authenticate(self.user.auth_secret)
+        self.app.auth_cache.invalidate(secret=self.user.auth_secret)
+        self.assertEqual(self.app.authenticate(self.user.auth_secret), self.user)
+        self.assertEqual(self.app.authenticate(self.staff_member.auth_secret), self.staff_member)
+        self.assertEqual((self.app.auth_cache.hits, self.app.auth_cache.misses), (1, 3))
+
+class AuthCacheTest(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = 0
+        self.cache = AuthCache(ttl=60, max_size=2, clock=lambda: self.now)
+
+    def test_get(self):
+        self.cache.set('secret', 'user')
+        self.assertEqual(self.cache.get('secret'), 'user')
+        self.assertIsNone(self.cache.get('foo'))
+        self.assertEqual(self.cache.hit_rate, 0.5)
+
+    def test_get_expired(self):
+        self.cache.set('secret', 'user')
+        self.now = 60
+        self.assertIsNone(self.cache.get('secret'))
+
+    def test_set_full(self):
+        self.cache.set('a', 'user')
+        self.cache.set('b', 'user')
+        self.cache.set('c', 'user')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('c'), 'user')
+
+    def test_invalidate(self):
+        self.cache.set('secret', 'user')
+        self.cache.invalidate(secret='secret')
+        self.assertIsNone(self.cache.get('secret'))
+
 class MeetlingUpdateTest(AsyncTestCase):
     @staticmethod
     def setup_db(tag):
@@ -56,17 +116,21 @@ class MeetlingUpdateTest(AsyncTestCase):
         check_output(['make', '-s', 'sample', 'REDISURL=15'], cwd=d)
 
     def test_update_db_fresh(self):
-        app = Meetling(redis_url='15')
+        app = Meetling(redis_url='memory:')
         app.r.flushdb()
         app.update()
         self.assertEqual(app.settings.title, 'My Meetling')
 
     def test_update_db_version_previous(self):
-        self.setup_db('0.16.4')
+        self.setup_db('0.19.0')
         app = Meetling(redis_url='15')
         app.update()
 
-        self.assertIsNone(app.settings.staff[0].email)
+        meeting = list(app.meetings.values())[0]
+        item = list(meeting.items.values())[0]
+        self.assertEqual(meeting.version, 0)
+        self.assertEqual(item.version, 0)
+        self.assertEqual(app.r.hget('agenda_item_meetings', item.id).decode(), meeting.id)
 
     def test_update_db_version_first(self):
         self.setup_db('0.16.4')
@@ -75,6 +139,8 @@ class MeetlingUpdateTest(AsyncTestCase):
 
         # Update to version 5
         self.assertIsNone(app.settings.staff[0].email)
+        # Update to version 6
+        self.assertEqual(list(app.meetings.values())[0].version, 0)
 
 class SettingsTest(MeetlingTestCase):
     def test_edit(self):
@@ -102,6 +168,84 @@ class MeetingTest(MeetlingTestCase):
         self.assertEqual(self.meeting.title, 'Awesome cat hangout')
         self.assertEqual(self.meeting.time, time)
         self.assertIsNone(self.meeting.description)
+        self.assertEqual(self.meeting.version, 1)
+
+    def test_edit_concurrent(self):
+        app = Meetling(redis_url=self.redis_url)
+        app.user = self.user
+        meeting = app.meetings[self.meeting.id]
+        meeting.edit(location='Garden')
+        self.meeting.edit(title='Awesome cat hangout')
+        self.assertEqual(self.meeting.title, 'Awesome cat hangout')
+        self.assertEqual(self.meeting.location, 'Garden')
+        self.assertEqual(self.meeting.version, 2)
+
+    def test_edit_conflict(self):
+        app = Meetling(redis_url=self.redis_url)
+        app.user = self.user
+        meeting = app.meetings[self.meeting.id]
+        meeting.edit(title='Cat party')
+        with self.assertRaises(ConflictError) as cm:
+            self.meeting.edit(title='Awesome cat hangout')
+        self.assertEqual(cm.exception.version, 1)
+        self.assertEqual(cm.exception.conflicts, ['title'])
+
+    def test_edit_coalesced(self):
+        self.app.edits.window = 60
+        self.meeting.edit(title='Awesome cat hangout')
+        self.meeting.edit(location='Garden')
+        meeting = self.app.meetings[self.meeting.id]
+        self.assertEqual(meeting.location, 'Garden')
+        self.assertEqual(meeting.version, 0)
+
+        self.app.edits.flush()
+        meeting = Meetling(redis_url=self.redis_url).meetings[self.meeting.id]
+        self.assertEqual(meeting.title, 'Awesome cat hangout')
+        self.assertEqual(meeting.location, 'Garden')
+        self.assertEqual(meeting.version, 1)
+
+    @gen_test
+    def test_edit_coalesced_timeout(self):
+        self.app.edits.window = 0.01
+        self.meeting.edit(title='Awesome cat hangout')
+        yield sleep(0.05)
+        meeting = Meetling(redis_url=self.redis_url).meetings[self.meeting.id]
+        self.assertEqual(meeting.title, 'Awesome cat hangout')
+        self.assertEqual(meeting.version, 1)
+
+    def test_edit_coalesced_conflict(self):
+        self.app.edits.window = 60
+        self.meeting.edit(title='Awesome cat hangout')
+        app = Meetling(redis_url=self.redis_url)
+        app.user = self.user
+        app.meetings[self.meeting.id].edit(location='Garden')
+        with self.assertRaises(ConflictError) as cm:
+            self.meeting.edit(location='Park')
+        self.assertEqual(cm.exception.conflicts, ['location'])
+        self.assertEqual(self.meeting.location, 'Garden')
+        # The pending edit is stored nonetheless
+        meeting = Meetling(redis_url=self.redis_url).meetings[self.meeting.id]
+        self.assertEqual(meeting.title, 'Awesome cat hangout')
+        self.assertEqual(meeting.location, 'Garden')
+
+    def test_edit_coalesced_pending_conflict(self):
+        self.app.edits.window = 60
+        self.meeting.edit(title='Awesome cat hangout', location='Garden')
+        app = Meetling(redis_url=self.redis_url)
+        app.user = self.user
+        app.meetings[self.meeting.id].edit(title='Cat party')
+        self.app.edits.flush()
+        self.assertEqual(self.meeting.title, 'Cat party')
+        meeting = Meetling(redis_url=self.redis_url).meetings[self.meeting.id]
+        self.assertEqual(meeting.title, 'Cat party')
+        self.assertEqual(meeting.location, 'Garden')
+
+    def test_edit_coalesced_other_user(self):
+        self.app.edits.window = 60
+        self.meeting.edit(title='Awesome cat hangout')
+        self.app.user = self.staff_member
+        self.meeting.edit(location='Garden')
+        self.assertEqual(self.meeting.version, 1)
 
     def test_create_agenda_item(self):
         # create_agenda_item() called by setUp()
@@ -111,6 +255,7 @@ class MeetingTest(MeetlingTestCase):
         self.meeting.trash_agenda_item(self.items[0])
         self.assertEqual(list(self.meeting.items.values()), self.items[1:])
         self.assertEqual(list(self.meeting.trashed_items.values()), [self.items[0]])
+        self.assertTrue(self.meeting.trashed_items[self.items[0].id].trashed)
 
     def test_trash_agenda_item_item_trashed(self):
         self.meeting.trash_agenda_item(self.items[0])
@@ -157,3 +302,13 @@ class AgendaItemTest(MeetlingTestCase):
         self.assertEqual(item.title, 'Intensive purring')
         self.assertEqual(item.duration, 10)
         self.assertIsNone(item.description)
+
+    def test_edit_concurrent(self):
+        meeting = self.app.create_meeting('Cat Hangout')
+        item = meeting.create_agenda_item('Purring')
+        app = Meetling(redis_url=self.redis_url)
+        app.user = self.user
+        app.meetings[meeting.id].items[item.id].edit(description='No snooping!')
+        item.edit(duration=10)
+        self.assertEqual(item.duration, 10)
+        self.assertEqual(item.description, 'No snooping!')
@@ -0,0 +1,53 @@
+# Meetling
+# Copyright (C) 2017 Meetling contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <http://www.gnu.org/licenses/>.
+
+# pylint: disable=missing-docstring; test module
+
+import signal
+from time import sleep
+from unittest import TestCase
+
+from meetling.profiler import Profiler
+
+class ProfilerTest(TestCase):
+    def test_start_stop(self):
+        profiler = Profiler(fraction=1)
+        self.assertTrue(profiler.start('GET MeetingEndpoint'))
+        sleep(0.02)
+        profiler.stop()
+        self.assertEqual(profiler.requests, 1)
+        self.assertTrue(profiler.stacks)
+        self.assertTrue(profiler.folded().startswith('GET MeetingEndpoint;'))
+
+    def test_start_disabled(self):
+        profiler = Profiler()
+        self.assertFalse(profiler.start('GET MeetingEndpoint'))
+        profiler.stop()
+        self.assertEqual(profiler.requests, 0)
+
+    def test_stop_previous_handler(self):
+        def handler(signum, frame):
+            # pylint: disable=unused-argument; signal handler
+            pass
+        previous = signal.signal(signal.SIGALRM, handler)
+        try:
+            profiler = Profiler(fraction=1)
+            profiler.start('GET MeetingEndpoint')
+            profiler.stop()
+            self.assertIs(signal.getsignal(signal.SIGALRM), handler)
+        finally:
+            signal.signal(signal.SIGALRM, previous)
+
+    def test_init_fraction_none(self):
+        self.assertEqual(Profiler(fraction=None).fraction, 0)
@@ -27,7 +27,7 @@ from meetling.server import make_server
 class MeetlingServerTest(ServerTestCase):
     def setUp(self):
         super().setUp()
-        self.server = make_server(port=16160, redis_url='15')
+        self.server = make_server(port=16160, redis_url='memory:')
         app = self.server.app
         app.r.flushdb()
         self.server.start()
@@ -69,3 +69,40 @@ class MeetlingServerTest(ServerTestCase):
         self.assertEqual(cm.exception.code, http.client.BAD_REQUEST)
         error = json.loads(cm.exception.response.body.decode())
         self.assertEqual(error.get('__type__'), 'ValueError')
+
+    @gen_test
+    def test_profiler(self):
+        yield self.request('/api/profiler', method='POST', body='{"fraction": 1}')
+        yield self.request('/api/meetings/' + self.meeting.id)
+        response = yield self.request('/api/profiler')
+        self.assertEqual(json.loads(response.body.decode())['requests'], 1)
+        response = yield self.request('/api/profiler/stacks')
+        self.assertEqual(response.code, http.client.OK)
+        self.assertEqual(response.headers['Content-Type'], 'text/plain; charset=UTF-8')
+
+    @gen_test
+    def test_post_profiler_fraction_bool(self):
+        with self.assertRaises(HTTPError) as cm:
+            yield self.request('/api/profiler', method='POST', body='{"fraction": true}')
+        self.assertEqual(cm.exception.code, http.client.BAD_REQUEST)
+
+    @gen_test
+    def test_post_profiler_as_user(self):
+        self.client_user = self.server.app.login()
+        with self.assertRaises(HTTPError) as cm:
+            yield self.request('/api/profiler', method='POST', body='{"fraction": 1}')
+        self.assertEqual(cm.exception.code, http.client.FORBIDDEN)
+
+    @gen_test
+    def test_post_meeting_move_agenda_item_conflict(self):
+        self.server.app.transaction_attempts = 0
+        with self.assertRaises(HTTPError) as cm:
+            yield self.request(
+                '/api/meetings/{}/move-agenda-item'.format(self.meeting.id), method='POST',
+                body='{{"item_id": "{}", "to_id": null}}'.format(self.item.id))
+        self.assertEqual(cm.exception.code, http.client.CONFLICT)
+        error = json.loads(cm.exception.response.body.decode())
+        self.assertEqual(error.get('__type__'), 'ConflictError')
+        self.assertEqual(error.get('code'), 'conflict')
+        self.assertIsNone(error.get('version'))
+        self.assertEqual(error.get('conflicts'), [])
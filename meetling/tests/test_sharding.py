@@ -0,0 +1,84 @@
+# Meetling
+# Copyright (C) 2017 Meetling contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <http://www.gnu.org/licenses/>.
+
+# pylint: disable=missing-docstring; test module
+
+from collections import Counter
+
+from micro.util import randstr
+from tornado.testing import AsyncTestCase
+
+from meetling import Meetling
+from meetling.sharding import ShardedRedis
+
+class ShardedRedisTest(AsyncTestCase):
+    def setUp(self):
+        super().setUp()
+        self.redis_url = 'memory:' + self.id()
+        self.shard_urls = ['memory:{}.{}'.format(self.id(), i) for i in range(2)]
+        self.app = Meetling(redis_url=self.redis_url, shard_urls=self.shard_urls)
+        self.app.r.flushdb()
+        self.app.update()
+        self.app.login()
+
+    def test_create_meeting(self):
+        meetings = [self.app.create_meeting('Cat hangout') for _ in range(8)]
+        items = [meeting.create_agenda_item('Purring') for meeting in meetings]
+        for meeting, item in zip(meetings, items):
+            node = self.app.r.r.node_for_tag(meeting.id)
+            self.assertTrue(node.exists(meeting.id))
+            self.assertTrue(node.exists(meeting.id + '.items'))
+            self.assertTrue(node.exists(item.id))
+        app = Meetling(redis_url=self.redis_url, shard_urls=self.shard_urls)
+        self.assertEqual(list(app.meetings.values()), meetings)
+
+    def test_node_for_tag(self):
+        r = ShardedRedis(self.app.r.r.primary,
+                         ['memory:{}.distribution.{}'.format(self.id(), i) for i in range(4)])
+        counts = Counter(r.node_for_tag('Meeting:' + randstr()) for _ in range(4000))
+        self.assertEqual(len(counts), 4)
+        for count in counts.values():
+            self.assertAlmostEqual(count / 4000, 1 / 4, delta=0.05)
+
+    def test_move_agenda_item(self):
+        meeting = self.app.create_meeting('Cat hangout')
+        items = [meeting.create_agenda_item('Eating'), meeting.create_agenda_item('Purring')]
+        meeting.move_agenda_item(items[1], None)
+        self.assertEqual(list(meeting.items.values()), list(reversed(items)))
+
+    def test_rebalance(self):
+        app = Meetling(redis_url=self.redis_url, shard_urls=self.shard_urls[:1])
+        app.user = self.app.user
+        meetings = [app.create_meeting('Cat hangout') for _ in range(8)]
+        for meeting in meetings:
+            meeting.create_agenda_item('Purring')
+
+        self.assertGreater(self.app.r.r.rebalance(), 0)
+        self.assertEqual(self.app.r.r.rebalance(), 0)
+        for meeting in meetings:
+            meeting = self.app.meetings[meeting.id]
+            self.assertEqual([i.title for i in meeting.items.values()], ['Purring'])
+
+    def test_rebalance_target_written(self):
+        app = Meetling(redis_url=self.redis_url, shard_urls=self.shard_urls[:1])
+        app.user = self.app.user
+        meeting = app.create_meeting('Cat hangout')
+        while self.app.r.r.node_for_tag(meeting.id) is app.r.r.node_for_tag(meeting.id):
+            meeting = app.create_meeting('Cat hangout')
+        self.app.r.r.node_for_tag(meeting.id).rpush(meeting.id + '.items', 'AgendaItem:new')
+
+        self.app.r.r.rebalance()
+        self.assertTrue(app.r.r.node_for_tag(meeting.id).exists(meeting.id))
+        self.assertEqual(self.app.r.r.node_for_tag(meeting.id).lrange(meeting.id + '.items', 0, -1),
+                         [b'AgendaItem:new'])
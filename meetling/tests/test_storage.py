@@ -0,0 +1,80 @@
+# Meetling
+# Copyright (C) 2017 Meetling contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <http://www.gnu.org/licenses/>.
+
+# pylint: disable=missing-docstring; test module
+
+import os
+from tempfile import mkdtemp
+from time import sleep
+from unittest import TestCase
+
+from redis.exceptions import WatchError
+
+from meetling.storage import MemoryRedis, connect
+
+class MemoryRedisTest(TestCase):
+    def setUp(self):
+        self.r = MemoryRedis()
+        self.r.rpush('cats', 'Happy', 'Grumpy', 'Ceiling')
+
+    def test_lrem(self):
+        self.assertEqual(self.r.lrem('cats', 1, 'Grumpy'), 1)
+        self.assertEqual(self.r.lrange('cats', 0, -1), [b'Happy', b'Ceiling'])
+
+    def test_linsert(self):
+        self.r.linsert('cats', 'after', 'Happy', 'Long')
+        self.assertEqual(self.r.lrange('cats', 0, -1), [b'Happy', b'Long', b'Grumpy', b'Ceiling'])
+
+    def test_pipeline(self):
+        with self.r.pipeline() as p:
+            p.watch('cats')
+            self.assertEqual(p.llen('cats'), 3)
+            p.multi()
+            p.lpush('cats', 'Long')
+            self.assertEqual(p.execute(), [4])
+
+    def test_pipeline_watched_modified(self):
+        with self.r.pipeline() as p:
+            p.watch('cats')
+            self.r.rpush('cats', 'Long')
+            p.multi()
+            p.lpush('cats', 'Long')
+            with self.assertRaises(WatchError):
+                p.execute()
+        self.assertEqual(self.r.llen('cats'), 4)
+
+    def test_expire(self):
+        self.r.set('cat', 'Happy', px=10)
+        self.r.expire('cats', 60)
+        self.assertEqual(self.r.ttl('cats'), 60)
+        self.assertEqual(self.r.get('cat'), b'Happy')
+        sleep(0.02)
+        self.assertIsNone(self.r.get('cat'))
+        self.assertEqual(self.r.keys(), [b'cats'])
+
+    def test_set_volatile(self):
+        self.r.set('cat', 'Happy', ex=60)
+        self.r.set('cat', 'Grumpy')
+        self.assertEqual(self.r.ttl('cat'), -1)
+
+    def test_save(self):
+        path = os.path.join(mkdtemp(), 'meetling.db')
+        r = connect('file:' + path)
+        r.hset('cat', 'name', 'Happy')
+        r.save()
+        self.assertEqual(MemoryRedis(path).hget('cat', 'name'), b'Happy')
+
+    def test_connect(self):
+        self.assertIs(connect('memory:cats'), connect('memory:cats'))
+        self.assertIsNot(connect('memory:'), connect('memory:'))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# Meetling
+# Copyright (C) 2017 Meetling contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <http://www.gnu.org/licenses/>.
+
+import sys
+sys.path.insert(0, '.')
+
+from collections import Counter
+import os
+from threading import Thread
+from time import perf_counter
+
+from meetling import Meetling, ConflictError
+
+ATTRS = ['title', 'location', 'description']
+
+def main(args):
+    args = {'redis_url': os.environ['REDISURL']} if 'REDISURL' in os.environ else {}
+    workers = int(os.environ.get('WORKERS', '8'))
+    n = int(os.environ.get('N', '200'))
+    app = Meetling(**args)
+    app.r.flushdb()
+    app.update()
+    user = app.login()
+    meeting = app.create_meeting('Cat hangout')
+    items = [meeting.create_agenda_item('Item {}'.format(i)) for i in range(10)]
+
+    # Per worker counters, summed after all workers are finished
+    worker_stats = [Counter() for _ in range(workers)]
+
+    def _edit(i):
+        worker_app = Meetling(**args)
+        worker_app.user = worker_app.users[user.id]
+        attr = ATTRS[i % len(ATTRS)]
+        for j in range(n):
+            try:
+                worker_app.meetings[meeting.id].edit(**{attr: '{} {}'.format(i, j)})
+                worker_stats[i]['edits'] += 1
+            except ConflictError:
+                worker_stats[i]['conflicts'] += 1
+
+    def _move(i):
+        worker_app = Meetling(**args)
+        worker_app.user = worker_app.users[user.id]
+        worker_meeting = worker_app.meetings[meeting.id]
+        for j in range(n):
+            item = items[(i + j) % len(items)]
+            to = items[(i + j * 7) % len(items)]
+            try:
+                worker_meeting.move_agenda_item(item, None if to == item else to)
+                worker_stats[i]['moves'] += 1
+            except ConflictError:
+                worker_stats[i]['conflicts'] += 1
+
+    threads = [Thread(target=_edit if i % 2 else _move, args=(i, )) for i in range(workers)]
+    t = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    t = perf_counter() - t
+    stats = {k: sum(s[k] for s in worker_stats) for k in ['edits', 'moves', 'conflicts']}
+
+    lost = {i.id for i in items} - set(meeting.items.keys())
+    print('Workers: {}, operations per worker: {}'.format(workers, n))
+    print('Edits: {edits}, moves: {moves}, conflicts: {conflicts}'.format(**stats))
+    print('Throughput: {:.0f} operations/s'.format((stats['edits'] + stats['moves']) / t))
+    print('Lost items: {}'.format(len(lost)))
+    return 1 if lost else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
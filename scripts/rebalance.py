@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+
+# Meetling
+# Copyright (C) 2017 Meetling contributors
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU
+# General Public License as published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without
+# even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with this program. If not,
+# see <http://www.gnu.org/licenses/>.
+
+import sys
+sys.path.insert(0, '.')
+
+import os
+from meetling import Meetling
+
+def main(args):
+    args = {'redis_url': os.environ['REDISURL']} if 'REDISURL' in os.environ else {}
+    args['shard_urls'] = os.environ.get('SHARDURLS', '').split()
+    app = Meetling(**args)
+    app.update()
+    count = app.r.r.rebalance()
+    print('Moved {} meetings'.format(count))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))